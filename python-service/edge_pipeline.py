@@ -0,0 +1,394 @@
+"""Shared edge rendering pipeline.
+
+Used by the Flask service (app.py) and the Vercel handlers in api/, so the
+page layout, edge slicing and request body decoding live in one place.
+"""
+import binascii
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+# Constants
+BLEED_INCHES = 0.125
+SAFETY_BUFFER_INCHES = 0.125  # Extra safety margin beyond bleed for cutting tolerance (match max variance)
+POINTS_PER_INCH = 72
+BLEED_POINTS = BLEED_INCHES * POINTS_PER_INCH
+SAFETY_BUFFER_POINTS = SAFETY_BUFFER_INCHES * POINTS_PER_INCH
+
+# Page thickness per type in inches
+PAGE_THICKNESS = {
+    "bw": 0.0032,        # Black and white (0.0030-0.0035" range)
+    "standard": 0.0032,  # Standard color (0.0030-0.0035" range)
+    "premium": 0.0037    # Premium color (0.0035-0.0039" range)
+}
+
+# Empty MuPDF's resource store every this many pages so long documents
+# don't grow it without bound
+STORE_SHRINK_PAGES = 16
+
+# Drop unused/duplicate objects and compress streams when writing the output
+PDF_SAVE_OPTIONS = dict(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+
+# JPEG quality for opaque edge strips; MuPDF embeds the JPEG stream as-is
+EDGE_JPEG_QUALITY = 90
+
+# Edge names, in the order they are drawn on each page
+EDGE_FIELDS = ("top", "bottom", "side")
+
+# The boundary parameter of a multipart Content-Type, and the field name in a
+# part's Content-Disposition header (not matching filename=)
+MULTIPART_BOUNDARY = re.compile(r'boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+MULTIPART_FIELD_NAME = re.compile(rb'^content-disposition:[^\r\n]*?;\s*name=(?:"([^"]*)"|([^;\s]+))', re.IGNORECASE | re.MULTILINE)
+
+def parse_multipart(body, content_type):
+    """Split a multipart/form-data body into a dict of field name -> raw bytes.
+
+    Parts are located with bytes.find and each payload is copied out once, so
+    the body is never duplicated or run through a MIME parser.
+    """
+    match = MULTIPART_BOUNDARY.search(content_type)
+    if not match:
+        raise ValueError("Multipart boundary missing")
+    delimiter = b"\r\n--" + (match.group(1) or match.group(2)).encode("latin-1")
+
+    # The first delimiter starts the body, so it has no leading CRLF
+    position = body.find(delimiter[2:])
+    if position < 0:
+        raise ValueError("Malformed multipart body")
+    position += len(delimiter) - 2
+
+    view = memoryview(body)
+    fields = {}
+    try:
+        while view[position:position + 2] != b"--":  # Closing delimiter
+            header_end = body.find(b"\r\n\r\n", position)
+            part_end = body.find(delimiter, header_end)
+            # A delimiter is only one if a line break or the closing "--"
+            # follows; the same text with more characters is payload
+            while part_end >= 0 and view[part_end + len(delimiter):part_end + len(delimiter) + 2] not in (b"\r\n", b"--"):
+                part_end = body.find(delimiter, part_end + 1)
+            if header_end < 0 or part_end < 0:
+                raise ValueError("Malformed multipart body")
+            name = MULTIPART_FIELD_NAME.search(bytes(view[position:header_end]))
+            if name:
+                fields[(name.group(1) or name.group(2)).decode("utf-8")] = bytes(view[header_end + 4:part_end])
+            position = part_end + len(delimiter)
+    finally:
+        view.release()
+    return fields
+
+def decode_base64(text, chunk_size=4 << 20):
+    """Decode a base64 string in chunks into a single preallocated buffer.
+
+    Avoids the full ASCII copy b64decode makes of the input, so peak memory
+    is the base64 text plus the decoded bytes.
+    """
+    buf = bytearray(len(text) * 3 // 4)
+    view = memoryview(buf)
+    written = 0
+    carry = b""
+    for start in range(0, len(text), chunk_size):
+        chunk = carry + text[start:start + chunk_size].encode("ascii").translate(None, b" \t\r\n")
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        decoded = binascii.a2b_base64(chunk[:usable])
+        view[written:written + len(decoded)] = decoded
+        written += len(decoded)
+    if carry:
+        raise ValueError("Invalid base64 data")
+    view.release()
+    del buf[written:]
+    return buf
+
+def open_edge_image(data, min_size):
+    """Open an edge image (raw bytes or a file path) for slicing.
+
+    JPEGs are decoded at the smallest DCT scale that still covers min_size,
+    and any image more than twice min_size is reduced. Images without
+    transparency, including ones whose alpha channel is fully opaque, are
+    kept as RGB so the resizes carry three channels instead of four and the
+    strips can be embedded as JPEG.
+    """
+    image = Image.open(data if isinstance(data, str) else io.BytesIO(data))
+    image.draft("RGB", min_size)
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        if image.getchannel("A").getextrema()[0] == 255:
+            image = image.convert("RGB")
+    else:
+        image = image.convert("RGB")
+
+    # Detail beyond twice min_size is averaged away by the strip resize, so
+    # box-reduce oversized images (draft only helps JPEGs) to bound that work
+    factors = (max(1, image.width // (2 * min_size[0])), max(1, image.height // (2 * min_size[1])))
+    if factors != (1, 1):
+        image = image.reduce(factors)
+    return image
+
+def build_leaf_strips(edge_img, first_leaf, count, slice_thickness, strip_size, vertical=False):
+    """Crop a run of consecutive leaf slices and stretch each one to the strip size.
+
+    Side edges are sliced across the image width; top and bottom edges
+    (vertical=True) across its height. Every leaf is resized on its own, so a
+    strip never blends in its neighbours' pixels and doesn't depend on how
+    the leaves were split into runs.
+
+    Slices are clamped to the image, since PIL pads crops past its edge with
+    black. Leaves whose slice starts past the edge (a PDF with more pages than
+    num_pages) get None and no strip is drawn, as the original RGBA crops
+    rendered them transparent.
+    """
+    extent = edge_img.height if vertical else edge_img.width
+    strips = []
+    for leaf in range(first_leaf, first_leaf + count):
+        start = leaf * slice_thickness
+        if start >= extent:
+            strips.append(None)
+            continue
+        end = min(start + slice_thickness, extent)
+        box = (0, start, edge_img.width, end) if vertical else (start, 0, end, edge_img.height)
+        strips.append(edge_img.crop(box).resize(strip_size, Image.Resampling.LANCZOS))
+    return strips
+
+def encode_strip(image):
+    """Encode an opaque strip as JPEG, which MuPDF embeds without recompressing.
+
+    Strips with alpha are returned premultiplied (PIL's "RGBa" mode), which is
+    how MuPDF expects pixmap samples; to_image_source wraps them in a
+    fitz.Pixmap later, on the thread that owns the document.
+    """
+    if image.mode == "RGBA":
+        return image.convert("RGBa")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=EDGE_JPEG_QUALITY)
+    return buffer.getvalue()
+
+def to_image_source(strip):
+    """Return the insert_image keyword arguments for a strip from encode_strip.
+
+    JPEG bytes are passed as a stream; premultiplied strips with alpha as a raw fitz.Pixmap.
+    """
+    if isinstance(strip, bytes):
+        return {"stream": strip}
+    return {"pixmap": fitz.Pixmap(fitz.csRGB, strip.width, strip.height, strip.tobytes(), True)}
+
+def precompute_strips(edge_img, num_strips, slice_thickness, strip_size, vertical=False):
+    """Build the edge strip image for every leaf, as insert_image keyword arguments
+    (None for leaves past the end of the image).
+
+    PIL releases the GIL while resizing and JPEG-encoding, so runs of leaves
+    are resized and encoded in parallel worker threads; only the fitz objects
+    are created on the calling thread.
+    """
+    workers = os.cpu_count() or 1
+    run_length = -(-num_strips // workers)  # One run of leaves per worker
+
+    def build_run(first_leaf):
+        strips = build_leaf_strips(
+            edge_img, first_leaf, min(run_length, num_strips - first_leaf),
+            slice_thickness, strip_size, vertical
+        )
+        return [None if strip is None else encode_strip(strip) for strip in strips]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        runs = executor.map(build_run, range(0, num_strips, run_length))
+        return [None if strip is None else to_image_source(strip) for run in runs for strip in run]
+
+def insert_mirrored_image(page, rect, xref):
+    """Draw an image XObject already embedded in the document, flipped horizontally, into rect on page."""
+    doc = page.parent
+    name = f"fzMirror{xref}"
+    # Register the image under /Resources/XObject, following /Resources and
+    # /XObject to their own objects when either is an indirect reference
+    # (xref_set_key can't write through one)
+    target, path = page.xref, ""
+    for key in ("Resources", "XObject"):
+        path = f"{path}/{key}" if path else key
+        kind, value = doc.xref_get_key(target, path)
+        if kind == "xref":
+            target, path = int(value.split()[0]), ""
+    doc.xref_set_key(target, f"{path}/{name}" if path else name, f"{xref} 0 R")
+    # Map the rect into PDF user space and use a negative x scale to mirror the image
+    r = rect * ~page.transformation_matrix
+    page.wrap_contents()
+    # Append the drawing as a content stream of its own, after the page's existing ones
+    stream_xref = doc.get_new_xref()
+    doc.update_object(stream_xref, "<<>>")
+    doc.update_stream(stream_xref, f"q {-r.width:g} 0 0 {r.height:g} {r.x1:g} {r.y0:g} cm /{name} Do Q".encode())
+    contents = page.get_contents() + [stream_xref]
+    doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{xref} 0 R" for xref in contents) + "]")
+
+def can_grow_in_place(pdf_doc):
+    """Whether every page can be enlarged in place instead of copied to a new page.
+
+    That needs unrotated pages that all share the first page's MediaBox, with
+    no separate CropBox and their own /Resources (so drawing the edges never
+    touches a dictionary inherited from the page tree).
+    """
+    mediabox = pdf_doc[0].mediabox
+    for page in pdf_doc:
+        if page.rotation or page.mediabox != mediabox or page.cropbox != mediabox:
+            return False
+        if pdf_doc.xref_get_key(page.xref, "Resources")[0] not in ("xref", "dict"):
+            return False
+    return True
+
+def render_document(pdf, edge_images, num_pages, page_type="standard", bleed_type="add_bleed", edge_type="side-only", num_leaves=None):
+    """Lay out every page with bleed and draw the printed edges.
+
+    pdf is the source PDF as raw bytes or a file path; edge_images maps
+    "side", "top" and "bottom" to image bytes or paths. Only the side edge is
+    used when edge_type is "side-only". Returns the new fitz.Document, which
+    the caller saves and closes.
+    """
+    pdf_doc = fitz.open(pdf) if isinstance(pdf, str) else fitz.open(stream=pdf, filetype="pdf")
+
+    original_width = pdf_doc[0].rect.width
+    original_height = pdf_doc[0].rect.height
+
+    # Calculate bleed dimensions - only add if bleed_type is 'add_bleed'
+    if bleed_type == "add_bleed":
+        bleed_points = BLEED_POINTS
+        new_width = original_width + bleed_points  # Add bleed only to outside edge
+        new_height = original_height + (2 * bleed_points)  # Add bleed to top and bottom
+    else:  # existing_bleed - PDF already has bleed, don't add more
+        bleed_points = 0
+        new_width = original_width
+        new_height = original_height
+
+    # Calculate number of leaves if not provided
+    if num_leaves is None:
+        num_leaves = (num_pages + 1) // 2  # Round up for odd pages
+    page_thickness_inches = PAGE_THICKNESS.get(page_type.lower(), 0.0032)
+    leaf_fraction = page_thickness_inches / (page_thickness_inches * num_leaves)
+
+    # Edge strips are always 0.25" so the final product is covered either way
+    edge_strip_width = BLEED_POINTS + SAFETY_BUFFER_POINTS
+    num_strips = (len(pdf_doc) + 1) // 2
+
+    # Where each edge is sliced and drawn: (strip size, right-page rect, left-page rect)
+    edge_layout = {
+        "top": (
+            (int(new_width), int(edge_strip_width)),
+            fitz.Rect(0, 0, new_width, edge_strip_width),
+            fitz.Rect(0, 0, new_width, edge_strip_width)
+        ),
+        "bottom": (
+            (int(new_width), int(edge_strip_width)),
+            fitz.Rect(0, new_height - edge_strip_width, new_width, new_height),
+            fitz.Rect(0, new_height - edge_strip_width, new_width, new_height)
+        ),
+        "side": (
+            (int(edge_strip_width), int(new_height)),
+            fitz.Rect(new_width - edge_strip_width, 0, new_width, new_height),
+            fitz.Rect(0, 0, edge_strip_width, new_height)
+        )
+    }
+
+    # Precompute the strip for every leaf once: the right page embeds it, the
+    # left page of the same leaf draws that image mirrored
+    names = ("side",) if edge_type == "side-only" else EDGE_FIELDS
+    edges = []
+    for name in names:
+        if not edge_images.get(name):
+            continue
+        strip_size, right_rect, left_rect = edge_layout[name]
+        vertical = name != "side"
+        if vertical:  # every leaf needs at least a strip's height of source rows
+            min_size = (strip_size[0], strip_size[1] * num_leaves)
+        else:  # every leaf needs at least a strip's width of source columns
+            min_size = (strip_size[0] * num_leaves, strip_size[1])
+        edge_img = open_edge_image(edge_images[name], min_size)
+
+        thickness = edge_img.height if vertical else edge_img.width
+        slice_thickness = max(1, int(thickness * leaf_fraction))
+        strips = precompute_strips(edge_img, num_strips, slice_thickness, strip_size, vertical)
+        edges.append((strips, right_rect, left_rect))
+
+    # Page geometry only depends on whether a page is a right (even index)
+    # or left (odd index) page, so build both variants up front
+    if bleed_type == "add_bleed":
+        # Right pages keep content at the spine side; left pages shift it past the left bleed
+        right_content_rect = fitz.Rect(0, bleed_points, original_width, bleed_points + original_height)
+        left_content_rect = fitz.Rect(bleed_points, bleed_points, bleed_points + original_width, bleed_points + original_height)
+    else:  # existing_bleed - use original positioning, PDF already has bleed
+        right_content_rect = left_content_rect = fitz.Rect(0, 0, original_width, original_height)
+
+    if can_grow_in_place(pdf_doc):
+        # Enlarge each source page's MediaBox around its content rather than
+        # copying the page onto a new one: the right page grows to the right,
+        # the left page to the left, both by the bleed at top and bottom
+        new_pdf = pdf_doc
+        mediabox = pdf_doc[0].mediabox
+        mediaboxes = (
+            fitz.Rect(mediabox.x0, mediabox.y0 - bleed_points, mediabox.x1 + bleed_points, mediabox.y1 + bleed_points),
+            fitz.Rect(mediabox.x0 - bleed_points, mediabox.y0 - bleed_points, mediabox.x1, mediabox.y1 + bleed_points)
+        )
+
+        def layout_page(page_num, side, content_rect):
+            page = pdf_doc[page_num]
+            if bleed_points:
+                page.set_mediabox(mediaboxes[side])
+            return page
+    else:
+        new_pdf = fitz.open()
+
+        def layout_page(page_num, side, content_rect):
+            page = new_pdf.new_page(width=new_width, height=new_height)
+            page.show_pdf_page(content_rect, pdf_doc, page_num)
+            return page
+
+    # Specialize the per-page work once per document: the renderers only vary
+    # with page_num, and pass along the xrefs of the current leaf's strips so
+    # the left page can draw the right page's images mirrored
+    def render_right(page_num, strip_xrefs):
+        new_page = layout_page(page_num, 0, right_content_rect)
+        return [
+            new_page.insert_image(right_rect, keep_proportion=False, **strips[page_num >> 1])
+            if strips[page_num >> 1] else None
+            for strips, right_rect, _ in edges
+        ]
+
+    def render_left(page_num, strip_xrefs):
+        new_page = layout_page(page_num, 1, left_content_rect)
+        for (_, _, left_rect), xref in zip(edges, strip_xrefs):
+            if xref:
+                insert_mirrored_image(new_page, left_rect, xref)
+        return strip_xrefs
+
+    renderers = (render_right, render_left)
+    strip_xrefs = []
+
+    for page_num in range(len(pdf_doc)):
+        strip_xrefs = renderers[page_num & 1](page_num, strip_xrefs)
+
+        if page_num % STORE_SHRINK_PAGES == STORE_SHRINK_PAGES - 1:
+            fitz.TOOLS.store_shrink(100)
+
+    if new_pdf is not pdf_doc:
+        pdf_doc.close()
+
+    return new_pdf
+
+def warm_up():
+    """Run a one-page synthetic document through the pipeline.
+
+    Loads PIL's codec plugins, the resize path and MuPDF once at import, so
+    the first real request (or every gunicorn worker forked after --preload)
+    starts warm.
+    """
+    Image.init()
+
+    sample = fitz.open()
+    sample.new_page(width=72, height=72).draw_rect(fitz.Rect(8, 8, 64, 64))
+    pdf_bytes = sample.tobytes()
+    sample.close()
+
+    edge = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(edge, format="PNG")
+
+    render_document(pdf_bytes, {"side": edge.getvalue()}, 1).close()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Import the service modules (edge_pipeline, app) the same way app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the caches of any imported app module out of the real tempdir
+os.environ.setdefault("OUTPUT_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("DOWNLOAD_CACHE_MAX_BYTES", "0")
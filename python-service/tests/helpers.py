@@ -0,0 +1,85 @@
+"""Test inputs, and the original per-page edge renderer to compare against."""
+import io
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+from edge_pipeline import BLEED_POINTS, PAGE_THICKNESS, SAFETY_BUFFER_POINTS
+
+def make_pdf(num_pages, width=432, height=648, rotation=0):
+    """A book PDF whose pages each carry a filled rect, so page placement shows in renders.
+
+    Rotated pages can't be grown in place, so they exercise the copy path.
+    """
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page(width=width, height=height)
+        page.draw_rect(fitz.Rect(40 + page_num, 60, 200, 300), color=(1, 0, 0), fill=(0, 0, 1))
+        page.set_rotation(rotation)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def make_edge(size=(400, 700), alpha=False, format="PNG"):
+    """An edge image with a colour gradient across it and, optionally, an alpha ramp."""
+    width, height = size
+    ramp = Image.linear_gradient("L")
+    image = Image.merge("RGB", [
+        ramp.rotate(90).resize(size),
+        Image.new("L", size, 200),
+        ramp.resize(size),
+    ])
+    if alpha:
+        image.putalpha(ramp.rotate(90).resize(size))
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def baseline_render(pdf, edge, num_pages, bleed_type="add_bleed", page_type="standard"):
+    """Render the side edge the way the original per-page code did.
+
+    Every page is copied onto a new page with show_pdf_page, its leaf slice is
+    cropped from the RGBA edge image and resized, and the strip is inserted as
+    a PNG (mirrored on left pages).
+    """
+    pdf_doc = fitz.open(stream=pdf, filetype="pdf")
+    edge_img = Image.open(io.BytesIO(edge)).convert("RGBA")
+    original_width, original_height = pdf_doc[0].rect.width, pdf_doc[0].rect.height
+    bleed_points = BLEED_POINTS if bleed_type == "add_bleed" else 0
+    new_width = original_width + bleed_points
+    new_height = original_height + 2 * bleed_points
+    num_leaves = (num_pages + 1) // 2
+    page_thickness = PAGE_THICKNESS[page_type]
+    slice_width = max(1, int(edge_img.width * (page_thickness / (page_thickness * num_leaves))))
+    strip_width = BLEED_POINTS + SAFETY_BUFFER_POINTS
+
+    new_pdf = fitz.open()
+    for page_num in range(len(pdf_doc)):
+        page = new_pdf.new_page(width=new_width, height=new_height)
+        x0 = bleed_points if page_num % 2 else 0
+        page.show_pdf_page(fitz.Rect(x0, bleed_points, x0 + original_width, bleed_points + original_height), pdf_doc, page_num)
+
+        start = (page_num // 2) * slice_width
+        strip = edge_img.crop((start, 0, start + slice_width, edge_img.height))
+        strip = strip.resize((slice_width, int(new_height)), Image.Resampling.LANCZOS)
+        strip = strip.resize((int(strip_width), int(new_height)), Image.Resampling.LANCZOS)
+        if page_num % 2:
+            strip = ImageOps.mirror(strip)
+            rect = fitz.Rect(0, 0, strip_width, new_height)
+        else:
+            rect = fitz.Rect(new_width - strip_width, 0, new_width, new_height)
+        buffer = io.BytesIO()
+        strip.save(buffer, format="PNG")
+        page.insert_image(rect, stream=buffer.getvalue(), keep_proportion=False)
+    pdf_doc.close()
+    return new_pdf
+
+def page_image(page):
+    """Rasterise a page to an RGB PIL image."""
+    pixmap = page.get_pixmap(alpha=False)
+    return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+def page_difference(page, other):
+    """Largest and mean per-channel difference between two rendered pages."""
+    difference = ImageChops.difference(page_image(page), page_image(other))
+    return max(high for _, high in difference.getextrema()), max(ImageStat.Stat(difference).mean)
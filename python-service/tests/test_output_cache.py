@@ -0,0 +1,72 @@
+import errno
+import os
+
+import pytest
+
+import app
+from helpers import make_edge, make_pdf
+
+@pytest.fixture
+def output_cache(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(app, "OUTPUT_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(app, "OUTPUT_CACHE_MAX_BYTES", 1 << 30)
+    return cache_dir
+
+# Built once: saved PDFs get a fresh /ID, so every make_pdf call has a new cache key
+PDF = make_pdf(4)
+EDGE = make_edge(format="JPEG")
+
+def render(num_pages=4):
+    result = app.render_to_file(PDF, {"side": EDGE}, num_pages)
+    assert result["status"] == "success", result
+    return result["output_path"]
+
+def test_identical_request_is_served_from_cache(output_cache, monkeypatch):
+    first = render()
+    os.unlink(first)
+
+    def fail_render(*args, **kwargs):
+        raise AssertionError("rendered again instead of using the cache")
+    monkeypatch.setattr(app, "render_document", fail_render)
+
+    second = render()
+    try:
+        cached, = output_cache.iterdir()
+        assert os.path.samefile(second, cached)
+    finally:
+        os.unlink(second)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    for age, name in enumerate(["newest", "middle", "oldest"]):
+        path = tmp_path / f"{name}.pdf"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+
+    app.evict_cache(str(tmp_path), 250)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["middle.pdf", "newest.pdf"]
+
+def test_cache_is_kept_within_its_size_limit(output_cache, monkeypatch):
+    os.unlink(render(num_pages=4))
+    cached, = output_cache.iterdir()
+    # Room for about one render: the next one should push the first out
+    monkeypatch.setattr(app, "OUTPUT_CACHE_MAX_BYTES", cached.stat().st_size * 3 // 2)
+    os.utime(cached, (0, 0))
+
+    os.unlink(render(num_pages=2))
+    remaining, = output_cache.iterdir()
+    assert remaining != cached
+
+def test_unusable_cache_serves_uncached_output(output_cache, monkeypatch):
+    # e.g. a cache dir on another filesystem than the tempdir
+    def cross_device_link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(app.os, "link", cross_device_link)
+
+    output_path = render()
+    try:
+        with open(output_path, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+    finally:
+        os.unlink(output_path)
+    assert not any(output_cache.iterdir())
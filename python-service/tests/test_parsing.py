@@ -0,0 +1,84 @@
+import base64
+import io
+
+import pytest
+from werkzeug.formparser import parse_form_data
+
+from edge_pipeline import decode_base64, parse_multipart
+from helpers import make_edge
+
+BOUNDARY = "----EdgeBoundary7MA4YWxkTrZu0gW"
+
+# Payloads that sit close to the delimiter without being one
+TRICKY_PAYLOAD = b"line one\r\n--not-the-boundary\r\n--" + BOUNDARY.encode() + b"x\r\n\r\n--\r\n"
+
+def encode_multipart(parts, boundary=BOUNDARY, preamble=b"", epilogue=b""):
+    """Build a multipart/form-data body from (name, filename, payload) parts."""
+    body = io.BytesIO()
+    body.write(preamble)
+    for name, filename, payload in parts:
+        body.write(b"--" + boundary.encode() + b"\r\n")
+        disposition = f'Content-Disposition: form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body.write(disposition.encode() + b"\r\n")
+        if filename is not None:
+            body.write(b"Content-Type: application/octet-stream\r\n")
+        body.write(b"\r\n" + payload + b"\r\n")
+    body.write(b"--" + boundary.encode() + b"--\r\n" + epilogue)
+    return body.getvalue()
+
+def werkzeug_fields(body, content_type):
+    """Parse a body with werkzeug's form parser, as Flask would, into name -> raw bytes."""
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": content_type,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    _, form, files = parse_form_data(environ)
+    fields = {name: value.encode("utf-8") for name, value in form.items()}
+    fields.update((name, storage.read()) for name, storage in files.items())
+    return fields
+
+@pytest.mark.parametrize("content_type, parts, preamble", [
+    (
+        f"multipart/form-data; boundary={BOUNDARY}",
+        [("numPages", None, b"30"), ("pdf", "book.pdf", b"%PDF-1.7\r\n" + bytes(range(256)) * 4)],
+        b"",
+    ),
+    (
+        f'multipart/form-data; boundary="{BOUNDARY}"; charset=utf-8',
+        [("side", "side.png", make_edge()), ("top", "top.txt", TRICKY_PAYLOAD)],
+        b"This is the preamble.\r\n",
+    ),
+    (
+        f"multipart/form-data; BOUNDARY={BOUNDARY}",
+        [("bleedType", None, b""), ("empty", "empty.bin", b""), ("pageType", None, b"standard")],
+        b"",
+    ),
+])
+def test_parse_multipart_matches_werkzeug(content_type, parts, preamble):
+    body = encode_multipart(parts, preamble=preamble, epilogue=b"trailing epilogue\r\n")
+    assert parse_multipart(body, content_type) == werkzeug_fields(body, content_type)
+
+@pytest.mark.parametrize("content_type, body", [
+    ("multipart/form-data", encode_multipart([("pdf", None, b"data")])),
+    (f"multipart/form-data; boundary={BOUNDARY}", b"no delimiter here"),
+    (f"multipart/form-data; boundary={BOUNDARY}", encode_multipart([("pdf", None, b"data")])[:-12]),
+])
+def test_parse_multipart_rejects_malformed_bodies(content_type, body):
+    with pytest.raises(ValueError):
+        parse_multipart(body, content_type)
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 4 << 20])
+def test_decode_base64_handles_wrapped_input(chunk_size):
+    # encodebytes wraps every 76 characters, so newlines fall mid-chunk and across chunk edges
+    data = make_edge(size=(64, 48)) + bytes(range(256))
+    text = base64.encodebytes(data).decode("ascii").replace("\n", "\r\n", 3)
+    assert decode_base64(text, chunk_size=chunk_size) == base64.b64decode(text) == data
+
+@pytest.mark.parametrize("text", ["abc", "ab c", "YWJj\nZA"])
+def test_decode_base64_rejects_truncated_input(text):
+    with pytest.raises(ValueError):
+        decode_base64(text, chunk_size=2)
@@ -0,0 +1,33 @@
+import pytest
+
+from edge_pipeline import render_document
+from helpers import baseline_render, make_edge, make_pdf, page_difference
+
+# JPEG-encoded strips and single-pass resizes stay within a few levels of the original PNG output
+MAX_PIXEL_DIFFERENCE = 8
+MAX_MEAN_DIFFERENCE = 0.5
+
+def assert_matches_baseline(pdf, edge, num_pages, bleed_type):
+    rendered = render_document(pdf, {"side": edge}, num_pages, bleed_type=bleed_type)
+    baseline = baseline_render(pdf, edge, num_pages, bleed_type)
+    assert len(rendered) == len(baseline)
+    for page, baseline_page in zip(rendered, baseline):
+        assert page.rect == baseline_page.rect
+        largest, mean = page_difference(page, baseline_page)
+        assert largest <= MAX_PIXEL_DIFFERENCE and mean <= MAX_MEAN_DIFFERENCE
+
+@pytest.mark.parametrize("rotation", [0, 90])
+@pytest.mark.parametrize("bleed_type", ["add_bleed", "existing_bleed"])
+def test_opaque_edge_matches_baseline(bleed_type, rotation):
+    # Unrotated pages are grown in place; rotated ones are copied onto new pages
+    assert_matches_baseline(make_pdf(9, rotation=rotation), make_edge(), 9, bleed_type)
+
+@pytest.mark.parametrize("bleed_type", ["add_bleed", "existing_bleed"])
+def test_partially_transparent_edge_matches_baseline(bleed_type):
+    # Raw RGBA pixmaps must be premultiplied, or semi-transparent strips render with wrapped colours
+    assert_matches_baseline(make_pdf(8), make_edge(alpha=True), 8, bleed_type)
+
+@pytest.mark.parametrize("bleed_type", ["add_bleed", "existing_bleed"])
+def test_pages_beyond_num_pages_get_no_strip(bleed_type):
+    # Leaves past the end of an opaque edge image must be left blank, not drawn as black bars
+    assert_matches_baseline(make_pdf(12), make_edge(format="JPEG"), 4, bleed_type)